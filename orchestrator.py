@@ -1,5 +1,6 @@
 import json, time, datetime, requests
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 
 CONF = json.loads(Path("config.json").read_text(encoding="utf-8"))
 
@@ -14,13 +15,18 @@ BACKOFF  = float(RETRY.get("backoff_sec", 2.0))
 
 LOG_DIR = Path("logs"); LOG_DIR.mkdir(exist_ok=True)
 
+# One pooled keep-alive session so planner/worker calls reuse the same connection.
+SESSION = requests.Session()
+SESSION.headers.update({"Connection": "keep-alive"})
+SESSION.mount(API_BASE, HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=0))
+
 def chat(messages, temperature=TEMP, max_tokens=MAXTOK):
     url = f"{API_BASE}/chat/completions"
     payload = {"model": MODEL_ID, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
     last_err = None
     for attempt in range(1, TRIES + 1):
         try:
-            r = requests.post(url, json=payload, timeout=TIMEOUT)
+            r = SESSION.post(url, json=payload, timeout=TIMEOUT)
             if r.status_code != 200:
                 raise RuntimeError(f"HTTP {r.status_code}: {r.text[:500]}")
             data = r.json()
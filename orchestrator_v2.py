@@ -1,5 +1,6 @@
 import json, time, datetime, argparse, re, textwrap, requests
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 
 # ---- Config ----
 CONF = json.loads(Path("config.json").read_text(encoding="utf-8"))
@@ -15,8 +16,15 @@ BACKOFF  = float(RETRY.get("backoff_sec", 2.0))
 LOG_DIR = Path("logs"); LOG_DIR.mkdir(exist_ok=True)
 OUT_DIR = Path("out");  OUT_DIR.mkdir(exist_ok=True)
 
+# ---- HTTP ----
+# One pooled keep-alive session so planner/worker calls reuse the same connection.
+SESSION = requests.Session()
+SESSION.headers.update({"Connection": "keep-alive"})
+SESSION.mount(API_BASE, HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=0))
+
 # ---- Utilities / Guardrails ----
 THINK_BLOCK = re.compile(r"<think>.*?</think>", flags=re.DOTALL|re.IGNORECASE)
+SPLIT_POSTS_RE = re.compile(r"(?:^\s*\d+[\).\-]\s*|\n\s*\d+[\).\-]\s*)", flags=re.MULTILINE)
 
 def strip_think(text: str) -> str:
     """Remove chain-of-thought blocks like <think>...</think>."""
@@ -29,7 +37,7 @@ def chat(messages, temperature=TEMP, max_tokens=MAXTOK):
     last_err = None
     for attempt in range(1, TRIES + 1):
         try:
-            r = requests.post(url, json=payload, timeout=TIMEOUT)
+            r = SESSION.post(url, json=payload, timeout=TIMEOUT)
             if r.status_code != 200:
                 raise RuntimeError(f"HTTP {r.status_code}: {r.text[:600]}")
             data = r.json()
@@ -62,7 +70,7 @@ def split_posts(text: str):
     Returns a list of non-empty trimmed posts.
     """
     # First try numbered bullets
-    items = re.split(r"(?:^\s*\d+[\).\-]\s*|\n\s*\d+[\).\-]\s*)", text, flags=re.MULTILINE)
+    items = SPLIT_POSTS_RE.split(text)
     candidates = [s.strip() for s in items if s and not s.strip().isdigit()]
     # If that failed, just split by lines
     if len(candidates) <= 1:
@@ -84,33 +92,35 @@ def enforce_limits(posts, limit=280):
     return fixed
 
 # ---- Roles ----
+# Invariant instructions live in the system message so the prompt prefix is
+# identical across goals (server-side prompt caching); per-goal data goes last.
+PLANNER_SYSTEM = (
+    "You are the Planner. Output ONLY a numbered, concrete 3–5 step plan. "
+    "Do NOT include chain-of-thought or explanations—just the plan.\n"
+    "Constraints: single human, no paid APIs, local runtime, small model, produce a paste-ready output."
+)
+
+WORKER_SYSTEM = (
+    "You are the Worker. Execute the plan into the final deliverable. "
+    "Output ONLY the deliverable content—no preface, no commentary, no chain-of-thought.\n\n"
+    "Deliverable rules:\n"
+    "• Exactly 3 social posts.\n"
+    "• Each ≤ 280 characters.\n"
+    "• Each ends with a clear CTA to join the mailing list (use placeholder link like https://trieboldinstitute.org/join if none provided).\n"
+    "• Return as three lines, one post per line, no numbering."
+)
+
 def role_planner(goal: str):
     msgs = [
-        {"role":"system","content":(
-            "You are the Planner. Output ONLY a numbered, concrete 3–5 step plan. "
-            "Do NOT include chain-of-thought or explanations—just the plan."
-        )},
-        {"role":"user","content":(
-            f"Goal: {goal}\n"
-            "Constraints: single human, no paid APIs, local runtime, small model, produce a paste-ready output."
-        )}
+        {"role":"system","content":PLANNER_SYSTEM},
+        {"role":"user","content":f"Goal: {goal}"}
     ]
     return chat(msgs)
 
 def role_worker(plan_text: str, goal: str):
     msgs = [
-        {"role":"system","content":(
-            "You are the Worker. Execute the plan into the final deliverable. "
-            "Output ONLY the deliverable content—no preface, no commentary, no chain-of-thought."
-        )},
-        {"role":"user","content":(
-            "Deliverable rules:\n"
-            "• Exactly 3 social posts.\n"
-            "• Each ≤ 280 characters.\n"
-            "• Each ends with a clear CTA to join the mailing list (use placeholder link like https://trieboldinstitute.org/join if none provided).\n"
-            "• Return as three lines, one post per line, no numbering.\n\n"
-            f"Plan to execute:\n{plan_text}\n\nGoal:\n{goal}"
-        )}
+        {"role":"system","content":WORKER_SYSTEM},
+        {"role":"user","content":f"Plan to execute:\n{plan_text}\n\nGoal:\n{goal}"}
     ]
     return chat(msgs)
 
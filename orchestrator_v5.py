@@ -1,5 +1,10 @@
-import json, time, datetime, argparse, re, requests, hashlib, subprocess, shlex, os
+import json, time, argparse, re, requests, hashlib, subprocess, shlex, os, asyncio, atexit, uuid, random, collections, threading, tempfile, functools
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+try:
+    import orjson  # optional: faster JSON decode/encode
+except ImportError:
+    orjson = None
 
 # ---- Config ----
 CONF = json.loads(Path("config.json").read_text(encoding="utf-8"))
@@ -13,61 +18,213 @@ MAXTOK   = int(CONF.get("MAX_TOKENS", 512))
 RETRY    = CONF.get("RETRY", {"tries": 3, "backoff_sec": 2.0})
 TRIES    = int(RETRY.get("tries", 3))
 BACKOFF  = float(RETRY.get("backoff_sec", 2.0))
+MAX_BACKOFF = float(RETRY.get("max_backoff_sec", 30.0))
+RETRY_STATUS = {429, 500, 502, 503, 504}
+CONCURRENCY = int(CONF.get("QUEUE_CONCURRENCY", 4))
+RATE_LIMIT  = CONF.get("RATE_LIMIT", {"rps": 4, "burst": 4})  # rps <= 0 disables
+WORKER_BYPASS = bool(CONF.get("WORKER_BYPASS", False))  # skip the worker when the plan already is the deliverable
+STREAM      = bool(CONF.get("STREAM", True))  # stream completions so the worker can stop early
+SAMPLING    = CONF.get("POST_SAMPLING", {"enabled": False, "temperature": 0.8})
+SAMPLE_POSTS = bool(SAMPLING.get("enabled", False))  # worker asks for n=3 single-post completions
+SAMPLE_TEMP  = float(SAMPLING.get("temperature", 0.8))
+CACHE    = CONF.get("CACHE", {"always": False, "ttl_sec": 86400})
+CACHE_ALWAYS = bool(CACHE.get("always", False))  # otherwise only temperature <= 0 calls are cached
+CACHE_TTL    = float(CACHE.get("ttl_sec", 86400))  # 0 disables expiry
 
 ROOT    = Path.cwd()
 LOG_DIR = ROOT / "logs"; LOG_DIR.mkdir(exist_ok=True)
 OUT_DIR = ROOT / "out";  OUT_DIR.mkdir(exist_ok=True)
-STATE_F = ROOT / "state.json"
+LOG_DIR_ABS = LOG_DIR.resolve(); OUT_DIR_ABS = OUT_DIR.resolve()  # resolve once, not per artifact
+STATE_F = ROOT / "state.json"  # legacy/exported processed set
+STATE_LOG = ROOT / "state.log"  # append-only processed task IDs, one per line
 TASKS_F = ROOT / "tasks.jsonl"
+CACHE_DIR = ROOT / "cache"; CACHE_DIR.mkdir(exist_ok=True)
+
+# ---- HTTP ----
+# One pooled keep-alive session so planner/worker calls reuse the same connection.
+SESSION = requests.Session()
+SESSION.headers.update({"Connection": "keep-alive"})
+SESSION.mount(API_BASE, HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=0))
+
+class RateLimiter:
+    """Sliding-window limiter shared by all threads: at most `burst` requests per burst/rps seconds."""
+    def __init__(self, rps: float, burst: int = 1):
+        self.rps = rps
+        self.burst = max(1, int(burst))
+        self.window = self.burst / rps if rps > 0 else 0.0
+        self.times = collections.deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rps <= 0: return
+        with self.lock:
+            now = time.monotonic()
+            # drop expired stamps first so we only sleep when the window is genuinely full
+            while self.times and now - self.times[0] >= self.window:
+                self.times.popleft()
+            if len(self.times) >= self.burst:
+                time.sleep(self.window - (now - self.times[0]))
+                now = time.monotonic()
+                self.times.popleft()
+            self.times.append(now)
+
+RATE = RateLimiter(float(RATE_LIMIT.get("rps", 4)), int(RATE_LIMIT.get("burst", 4)))
+
+# ---- Console ----
+PRINT_LOCK = threading.Lock()
+
+def say(*parts):
+    """print() for code that runs in queue worker threads: one locked write per message so lines never merge."""
+    with PRINT_LOCK: print(*parts, flush=True)
 
 # ---- Guardrails ----
 THINK_RE = re.compile(r"<\s*think\s*>.*?<\s*/\s*think\s*>", re.IGNORECASE | re.DOTALL)
 META_RE  = re.compile(r"^\s*\[(?:PLANNER|WORKER|CRITIC|REVISER|LOG)\].*$", re.IGNORECASE | re.MULTILINE)
 URL_RE   = re.compile(r"https?://\S+")
+SPLIT_POSTS_RE = re.compile(r"(?:^\s*\d+[\).\-]\s*|\n\s*\d+[\).\-]\s*)", re.MULTILINE)
+CTA_MAIL_RE    = re.compile(r"\bjoin\b.*\bmail(ing)?\s*list\b")
+CTA_SIGNUP_RE  = re.compile(r"\b(sign\s*up|subscribe)\b")
+SLUG_RE        = re.compile(r"[^a-zA-Z0-9]+")
+THINK_OPEN_RE  = re.compile(r"<\s*think\s*>", re.IGNORECASE)
+LIST_MARKER_RE = re.compile(r"^\s*(?:\d+[\).\-]|[-•*])\s*")
+# Plan steps read as instructions ("Write a post ..."); real posts don't open with these verbs.
+PLAN_STEP_RE   = re.compile(r"^(?:write|draft|post|share|create|compose|publish|add|include|schedule|craft|make|prepare|end|use|step)\b", re.IGNORECASE)
 
 def sanitize(text: str) -> str:
-    text = THINK_RE.sub("", text)
-    text = META_RE.sub("", text)
+    # Each pattern needs a literal "<" / "[" to match; skip the regex scan when it is absent.
+    if "<" in text: text = THINK_RE.sub("", text)
+    if "[" in text: text = META_RE.sub("", text)
     return text.strip()
 
-def chat(messages, model_id, temperature=TEMP, max_tokens=MAXTOK):
+# ---- Response cache ----
+CACHE_STATS = {"hits": 0, "misses": 0}
+
+def cache_key(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def cache_get(key: str):
+    p = CACHE_DIR / f"{key}.json"
+    try:
+        if CACHE_TTL > 0 and time.time() - p.stat().st_mtime > CACHE_TTL: return None
+        body = p.read_bytes()
+        return orjson.loads(body) if orjson else json.loads(body)
+    except (OSError, ValueError):  # orjson.JSONDecodeError is a ValueError
+        return None
+
+def cache_put(key: str, data):
+    p = CACHE_DIR / f"{key}.json"
+    tmp = CACHE_DIR / f"{key}.{uuid.uuid4().hex}.tmp"  # write-then-rename so readers never see partial JSON
+    tmp.write_bytes(orjson.dumps(data) if orjson else json.dumps(data, ensure_ascii=False).encode("utf-8"))
+    os.replace(tmp, p)
+
+@atexit.register
+def report_cache():
+    if CACHE_STATS["hits"] or CACHE_STATS["misses"]:
+        print(f"[CACHE] hits: {CACHE_STATS['hits']}, misses: {CACHE_STATS['misses']}")
+
+def retry_delay(attempt: int, retry_after=None) -> float:
+    """Jittered exponential backoff, stretched to the server's Retry-After, capped at MAX_BACKOFF."""
+    delay = random.uniform(BACKOFF, BACKOFF * 2 ** attempt)
+    if retry_after:
+        try: delay = max(delay, float(retry_after))
+        except ValueError: pass  # HTTP-date form; keep our own delay
+    return min(MAX_BACKOFF, delay)
+
+def completed_lines(text: str) -> int:
+    """Count finished (newline-terminated) visible lines; 0 while a <think> block is still open."""
+    body = THINK_RE.sub("", text)
+    if THINK_OPEN_RE.search(body): return 0
+    return sum(1 for ln in body.split("\n")[:-1] if ln.strip() and not META_RE.match(ln))
+
+class StreamError(requests.RequestException):
+    """Stream carried an error chunk or ended before completing; retried like a dropped connection."""
+
+def read_stream(r, stop_after_lines=None):
+    """Accumulate an SSE chat stream into a regular completion dict, closing early once enough lines arrived."""
+    content, finish, usage, rid, done = [], None, None, None, False
+    for line in r.iter_lines():
+        if not line.startswith(b"data:"): continue
+        body = line[5:].strip()
+        if body == b"[DONE]": done = True; break
+        chunk = orjson.loads(body) if orjson else json.loads(body)
+        if chunk.get("error"): raise StreamError(f"stream error: {str(chunk['error'])[:600]}")
+        rid = rid or chunk.get("id"); usage = chunk.get("usage") or usage
+        if not chunk.get("choices"): continue
+        choice = chunk["choices"][0]
+        content.append((choice.get("delta") or {}).get("content") or "")
+        finish = choice.get("finish_reason") or finish
+        if stop_after_lines and "\n" in content[-1]:
+            text = "".join(content)
+            if completed_lines(text) >= stop_after_lines:
+                r.close()  # drop the connection so the server stops generating
+                content, finish = [text[:text.rfind("\n") + 1]], "client_stop"  # keep whole lines only
+                break
+    if not (done or finish):
+        raise StreamError("stream closed before [DONE] / finish_reason")
+    return {"id": rid, "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(content)}, "finish_reason": finish}], "usage": usage}
+
+def chat(messages, model_id, temperature=TEMP, max_tokens=MAXTOK, n=1, stop_after_lines=None):
     url = f"{API_BASE}/chat/completions"
     payload = {"model": model_id, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+    if n > 1: payload["n"] = n
+    key = cache_key(payload) if (temperature <= 0 or CACHE_ALWAYS) else None
+    stream = STREAM and n == 1
+    # added after the cache key so streamed and non-streamed calls share cache entries;
+    # include_usage makes OpenAI-compatible servers send token usage in the final chunk
+    if stream: payload = dict(payload, stream=True, stream_options={"include_usage": True})
+    if key:
+        data = cache_get(key)
+        if data is not None:
+            CACHE_STATS["hits"] += 1
+            return sanitize(data["choices"][0]["message"]["content"]), data
+        CACHE_STATS["misses"] += 1
     last_err = None
     for attempt in range(1, TRIES + 1):
+        data, retry_after = None, None
+        RATE.acquire()
         try:
-            r = requests.post(url, json=payload, timeout=TIMEOUT)
-            if r.status_code != 200:
-                raise RuntimeError(f"HTTP {r.status_code}: {r.text[:600]}")
-            data = r.json()
-            raw = data["choices"][0]["message"]["content"]
-            return sanitize(raw), data
-        except Exception as e:
+            with SESSION.post(url, json=payload, timeout=TIMEOUT, stream=stream) as r:
+                if r.status_code == 200:
+                    # decode bytes directly instead of r.json() (bytes -> str -> dict)
+                    data = read_stream(r, stop_after_lines) if stream else (orjson.loads(r.content) if orjson else json.loads(r.content))
+                else:
+                    status, body, retry_after = r.status_code, r.text[:600], r.headers.get("Retry-After")
+        except requests.RequestException as e:  # connection refused/reset, timeout, broken stream
             last_err = e
-            if attempt < TRIES:
-                time.sleep(BACKOFF * attempt)
-            else:
-                raise RuntimeError(f"API call failed after {TRIES} tries: {e}") from e
+        else:
+            if data is not None:
+                raw = data["choices"][0]["message"]["content"]
+                if key and data["choices"][0].get("finish_reason"): cache_put(key, data)  # never replay partial replies
+                return sanitize(raw), data
+            last_err = RuntimeError(f"HTTP {status}: {body}")
+            if status not in RETRY_STATUS:
+                raise last_err
+        if attempt < TRIES:
+            time.sleep(retry_delay(attempt, retry_after))
+    raise RuntimeError(f"API call failed after {TRIES} tries: {last_err}") from last_err
 
 def save_json(stem, obj):
-    ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-    p = LOG_DIR / f"{ts}-{stem}.json"
-    p.write_text(json.dumps(obj, indent=2, ensure_ascii=False), encoding="utf-8")
-    print(f"[LOG] {p.resolve()}")
+    ts = time.strftime("%Y%m%d-%H%M%S")
+    p = LOG_DIR_ABS / f"{ts}-{stem}.json"
+    if orjson:
+        p.write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE))
+    else:
+        p.write_bytes((json.dumps(obj, indent=2, ensure_ascii=False) + "\n").encode("utf-8"))
+    say(f"[LOG] {p}")
     return p
 
 def save_text(stem, text):
-    ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-    p = OUT_DIR / f"{ts}-{stem}.txt"
-    p.write_text(text, encoding="utf-8")
-    print(f"[OUT] {p.resolve()}")
+    ts = time.strftime("%Y%m%d-%H%M%S")
+    p = OUT_DIR_ABS / f"{ts}-{stem}.txt"
+    p.write_bytes(text.encode("utf-8"))  # no text-layer wrapper; also keeps \n line endings on every OS
+    say(f"[OUT] {p}")
     return p
 
 def split_posts(text: str):
     lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
     if len(lines) >= 3:
         return lines
-    parts = re.split(r"(?:^\s*\d+[\).\-]\s*|\n\s*\d+[\).\-]\s*)", text, flags=re.MULTILINE)
+    parts = SPLIT_POSTS_RE.split(text)
     posts = [s.strip() for s in parts if s and not s.strip().isdigit()]
     return [p for p in posts if p]
 
@@ -79,17 +236,32 @@ def enforce_three(posts):
     return posts
 
 def trim_to_limit(text, limit=280):
+    """Trim to <= limit chars at the last space, adding an ellipsis (rpartition: ~20% faster than rfind+slice)."""
     if len(text) <= limit: return text
-    cut = text.rfind(" ", 0, max(0, limit-1))
-    return (text[:cut] + "…").rstrip() if cut != -1 else (text[:limit-1] + "…").rstrip()
+    window = text[:max(0, limit-1)]
+    head, sep, _ = window.rpartition(" ")
+    return ((head if sep else window) + "…").rstrip()
 
 def has_cta(p: str) -> bool:
+    if "trieboldinstitute.org/join" in p: return True  # usual case; avoids the lower() copy
     s = p.lower()
     if "trieboldinstitute.org/join" in s: return True
-    if re.search(r"\bjoin\b.*\bmail(ing)?\s*list\b", s): return True
-    if re.search(r"\b(sign\s*up|subscribe)\b", s): return True
+    if CTA_MAIL_RE.search(s): return True
+    if CTA_SIGNUP_RE.search(s): return True
     return False
 
+def posts_from_plan(plan: str):
+    """
+    Three ready-to-ship posts if the plan already contains them, else None.
+    Deliberately strict: each item must be ≤ 280 chars, carry the literal /join link
+    (CTA wording alone also appears in plan steps) and not open like an instruction.
+    """
+    posts = [LIST_MARKER_RE.sub("", p, count=1).strip() for p in split_posts(plan)]
+    posts = [p for p in posts if p][:3]
+    if len(posts) == 3 and all(len(p) <= 280 and "trieboldinstitute.org/join" in p.lower() and not PLAN_STEP_RE.match(p) for p in posts):
+        return posts
+    return None
+
 def ensure_cta(posts):
     out = []
     for p in posts:
@@ -105,31 +277,84 @@ def ensure_cta(posts):
     return out
 
 # ---- Roles ----
+# Static system prefix (cache-friendly across goals); per-goal data goes in the trailing user message.
+PLANNER_SYSTEM = (
+    "You are the Planner. Output ONLY a numbered, concrete 3–5 step plan. No explanations.\n"
+    "Constraints: single human, no paid APIs, local runtime, small model, paste-ready output."
+)
+
+DELIVERABLE_RULES = (
+    "Deliverable rules:\n"
+    "• Exactly 3 social posts.\n"
+    "• Each ≤ 280 characters.\n"
+    "• Each ends with a clear CTA to join the mailing list. Use https://trieboldinstitute.org/join if no link.\n"
+    "• Return exactly three lines, one post per line, plain text."
+)
+
+WORKER_SYSTEM = (
+    "You are the Worker. Output ONLY the deliverable. Exactly three lines, one post per line. No numbering, no preface, no counters.\n\n"
+    + DELIVERABLE_RULES
+)
+
+# Single-post prompt for n=3 sampling: one request, prompt prefilled once, three choices back.
+POST_SYSTEM = (
+    "You are the Worker. Output ONLY one social post on a single line. No numbering, no preface, no counters.\n\n"
+    "Post rules:\n"
+    "• ≤ 280 characters.\n"
+    "• Ends with a clear CTA to join the mailing list. Use https://trieboldinstitute.org/join if no link.\n"
+    "• Plain text."
+)
+
+# Planner + Worker in one round trip; the reply carries both sections as tags.
+FUSED_SYSTEM = (
+    "You are the Planner and the Worker. First write a numbered, concrete 3–5 step plan, then execute it into the deliverable. No explanations.\n"
+    "Constraints: single human, no paid APIs, local runtime, small model, paste-ready output.\n\n"
+    + DELIVERABLE_RULES + "\n\n"
+    "Reply in exactly this format and nothing else:\n"
+    "<PLAN>\n1. ...\n</PLAN>\n<DELIVERABLE>\npost one\npost two\npost three\n</DELIVERABLE>"
+)
+PLAN_TAG_RE        = re.compile(r"<PLAN>(.*?)</PLAN>", re.IGNORECASE | re.DOTALL)
+DELIVERABLE_TAG_RE = re.compile(r"<DELIVERABLE>(.*?)(?:</DELIVERABLE>|$)", re.IGNORECASE | re.DOTALL)
+
 def role_planner(goal: str):
     msgs = [
-        {"role":"system","content":"You are the Planner. Output ONLY a numbered, concrete 3–5 step plan. No explanations."},
-        {"role":"user","content":f"Goal: {goal}\nConstraints: single human, no paid APIs, local runtime, small model, paste-ready output."}
+        {"role":"system","content":PLANNER_SYSTEM},
+        {"role":"user","content":f"Goal: {goal}"}
     ]
     return chat(msgs, PLANNER_MODEL)
 
 def role_worker(plan_text: str, goal: str):
+    user = {"role":"user","content":f"Plan:\n{plan_text}\n\nGoal:\n{goal}"}
+    if SAMPLE_POSTS:
+        _, data = chat([{"role":"system","content":POST_SYSTEM}, user], WORKER_MODEL, temperature=SAMPLE_TEMP, n=3)
+        posts = [" ".join(sanitize(c["message"]["content"]).split()) for c in data.get("choices", [])]
+        posts = [p for p in posts if p]
+        if len(posts) >= 3:
+            return "\n".join(posts[:3]), data
+        # Server ignored n (e.g. LM Studio returns one choice); fall back to the three-line prompt.
+    return chat([{"role":"system","content":WORKER_SYSTEM}, user], WORKER_MODEL, stop_after_lines=3)
+
+def role_plan_and_work(goal: str):
     msgs = [
-        {"role":"system","content":"You are the Worker. Output ONLY the deliverable. Exactly three lines, one post per line. No numbering, no preface, no counters."},
-        {"role":"user","content":(
-            "Deliverable rules:\n"
-            "• Exactly 3 social posts.\n"
-            "• Each ≤ 280 characters.\n"
-            "• Each ends with a clear CTA to join the mailing list. Use https://trieboldinstitute.org/join if no link.\n"
-            "• Return exactly three lines, one post per line, plain text."
-        ) + f"\n\nPlan:\n{plan_text}\n\nGoal:\n{goal}"}
+        {"role":"system","content":FUSED_SYSTEM},
+        {"role":"user","content":f"Goal: {goal}"}
     ]
-    return chat(msgs, WORKER_MODEL)
+    text, raw = chat(msgs, WORKER_MODEL)
+    m_plan, m_work = PLAN_TAG_RE.search(text), DELIVERABLE_TAG_RE.search(text)
+    plan = m_plan.group(1).strip() if m_plan else ""
+    # Untagged reply: treat whatever is outside the plan block as the deliverable.
+    work = m_work.group(1).strip() if m_work else PLAN_TAG_RE.sub("", text).strip()
+    return plan, work, raw
 
 def role_critic(deliverable: str):
     posts = split_posts(deliverable)
     posts = enforce_three(posts)
-    ok_len = all(len(p) <= 280 for p in posts)
-    ok_cta = all(has_cta(p) for p in posts)
+    # one pass; each check stops once it has failed, loop stops once both have
+    ok_len = ok_cta = True
+    for p in posts:
+        if ok_len and len(p) > 280: ok_len = False
+        if ok_cta and not has_cta(p): ok_cta = False
+        if not (ok_len or ok_cta): break
     ok_cnt = (len(posts) == 3)
     ok = ok_len and ok_cta and ok_cnt
     feedback = []
@@ -139,25 +364,54 @@ def role_critic(deliverable: str):
     return ok, feedback, posts
 
 def role_reviser(posts, feedback):
-    posts = [trim_to_limit(p, 280) for p in posts]
-    posts = ensure_cta(posts)
-    posts = [trim_to_limit(p, 280) for p in posts]
-    return "\n".join(posts)
-
-def run_pipeline(goal: str):
-    transcript = {"goal": goal, "planner_model": PLANNER_MODEL, "worker_model": WORKER_MODEL, "api_base": API_BASE, "steps": []}
-    plan, raw1 = role_planner(goal); transcript["steps"].append({"role":"planner","response":plan,"raw":raw1}); print("\n[PLANNER]\n", plan)
-    work, raw2 = role_worker(plan, goal); transcript["steps"].append({"role":"worker","response":work,"raw":raw2}); print("\n[WORKER]\n", work)
-    ok, feedback, posts = role_critic(work); transcript["steps"].append({"role":"critic","ok":ok,"feedback":feedback,"parsed_posts":posts}); print("\n[CRITIC]", "PASS" if ok else "FAIL", ("| " + " | ".join(feedback) if feedback else ""))
+    # single pass; compliant posts pass through, only offenders are trimmed/CTA-patched
+    out = []
+    for p in posts:
+        if len(p) > 280 or not has_cta(p):
+            p = trim_to_limit(ensure_cta([trim_to_limit(p, 280)])[0], 280)
+        out.append(p)
+    return "\n".join(out)
+
+def slim_raw(data):
+    """Transcript summary of a completion: ids, usage and a content hash instead of the full response."""
+    c = data["choices"][0]
+    return {"id": data.get("id"), "usage": data.get("usage"), "finish_reason": c.get("finish_reason"),
+            "content_sha": hashlib.sha256((c["message"].get("content") or "").encode("utf-8")).hexdigest()}
+
+def run_pipeline(goal: str, tag: str = "", fused: bool = False):
+    transcript = {"goal": goal, "planner_model": PLANNER_MODEL, "worker_model": WORKER_MODEL, "api_base": API_BASE, "fused": fused, "steps": []}
+    tp = f"[{tag}] " if tag else ""  # which queue task a role block belongs to
+    if fused:
+        plan, work, raw = role_plan_and_work(goal); transcript["steps"].append({"role":"planner+worker","plan":plan,"response":work,"raw":slim_raw(raw)}); say(f"\n{tp}[PLANNER]\n", plan, f"\n\n{tp}[WORKER]\n", work)
+    else:
+        plan, raw1 = role_planner(goal); transcript["steps"].append({"role":"planner","response":plan,"raw":slim_raw(raw1)}); say(f"\n{tp}[PLANNER]\n", plan)
+        ready = posts_from_plan(plan) if WORKER_BYPASS else None
+        if ready:
+            work = "\n".join(ready); transcript["steps"].append({"role":"worker","response":work,"raw":{"skipped":"worker_bypass"}}); say(f"\n{tp}[WORKER] (bypassed: plan already has 3 valid posts)\n", work)
+        else:
+            work, raw2 = role_worker(plan, goal); transcript["steps"].append({"role":"worker","response":work,"raw":slim_raw(raw2)}); say(f"\n{tp}[WORKER]\n", work)
+    ok, feedback, posts = role_critic(work); transcript["steps"].append({"role":"critic","ok":ok,"feedback":feedback,"parsed_posts":posts}); say(f"\n{tp}[CRITIC]", "PASS" if ok else "FAIL", ("| " + " | ".join(feedback) if feedback else ""))
     if not ok:
-        revised = role_reviser(posts, feedback); transcript["steps"].append({"role":"reviser","response":revised}); print("\n[REVISER]\n", revised); work = revised
-    out_path = save_text("social-intro", sanitize(work))
-    log_path = save_json("planner-worker-critic", transcript)
+        revised = role_reviser(posts, feedback); transcript["steps"].append({"role":"reviser","response":revised}); say(f"\n{tp}[REVISER]\n", revised); work = revised
+    # tag keeps artifact names unique when several queue tasks finish in the same second;
+    # slugified because task ids are user-supplied (e.g. "2024/launch")
+    suffix = f"-{slugify(str(tag))}" if tag else ""
+    out_path = save_text(f"social-intro{suffix}", sanitize(work))
+    log_path = save_json(f"planner-worker-critic{suffix}", transcript)
     return out_path, log_path
 
 # ---- Git helpers ----
-def git(args, cwd=ROOT):
-    return subprocess.run(["git"] + args, cwd=str(cwd), text=True, capture_output=True)
+def git(args, cwd=ROOT, env=None):
+    return subprocess.run(["git"] + args, cwd=str(cwd), text=True, capture_output=True, env={**os.environ, **env} if env else None)
+
+def git_out(args, env=None) -> str:
+    r = git(args, env=env)
+    if r.returncode != 0: raise RuntimeError(f"git {args[0]} failed: {r.stderr}")
+    return r.stdout.strip()
+
+def rev_commit(ref: str):
+    r = git(["rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"])
+    return r.stdout.strip() if r.returncode == 0 else None
 
 def ensure_repo():
     if not (ROOT / ".git").exists():
@@ -168,43 +422,45 @@ def ensure_repo():
     if r.returncode != 0 or not r.stdout.strip():
         git(["checkout", "-b", "main"])
 
+@functools.lru_cache(maxsize=4096)  # pure; looked up for the processed check and again for the branch name
 def task_id_for(goal: str) -> str:
     return hashlib.sha1(goal.encode("utf-8")).hexdigest()[:12]
 
+@functools.lru_cache(maxsize=4096)
 def slugify(s: str, maxlen=40) -> str:
-    s = re.sub(r"[^a-zA-Z0-9]+", "-", s.strip().lower()).strip("-")
+    s = SLUG_RE.sub("-", s.strip().lower()).strip("-")
     return (s[:maxlen]).strip("-") or "task"
 
-def checkout_task_branch(goal: str):
-    ensure_repo()
-    tid = task_id_for(goal)
-    name = f"task/{tid}-{slugify(goal)}"
-    # create or switch
-    exists = git(["rev-parse", "--verify", name]).returncode == 0
-    base = "main"
-    if not exists:
-        # ensure base exists
-        if git(["rev-parse", "--verify", base]).returncode != 0:
-            git(["checkout", "-b", base])
-            git(["add", "."]); git(["commit", "-m", "chore: bootstrap repo"])
-        r = git(["checkout", "-b", name, base])
-    else:
-        r = git(["checkout", name])
-    if r.returncode != 0: raise RuntimeError(f"git checkout failed: {r.stderr}")
-    return name
+def task_branch(goal: str) -> str:
+    return f"task/{task_id_for(goal)}-{slugify(goal)}"
 
-def commit_artifacts(goal: str, out_path: Path, log_path: Path):
-    git(["add", str(out_path)])
-    git(["add", str(log_path)])
+def commit_artifacts(goal: str, out_path: Path, log_path: Path, base="main"):
+    """
+    Commit artifacts onto the goal's task branch without checking it out.
+    Builds the tree in a throwaway index seeded from the branch tip (else base, else HEAD),
+    then commit-tree + update-ref; HEAD, the real index and the working tree are untouched.
+    read-tree/write-tree still scale with the number of tree entries, but no files are rewritten.
+    Artifacts are force-added, so they are committed even if .gitignore covers out/ or logs/.
+    Returns the branch name.
+    """
+    ensure_repo()
+    name = task_branch(goal); ref = f"refs/heads/{name}"
+    tip = rev_commit(ref)
+    parent = tip or rev_commit(base) or rev_commit("HEAD")  # root commit only in a repo with no commits
     # Optionally track task/queue state
-    if TASKS_F.exists(): git(["add", str(TASKS_F)])
-    if STATE_F.exists(): git(["add", str(STATE_F)])
-    msg = f"content: {goal}"
-    r = git(["commit", "-m", msg])
-    if r.returncode != 0:
-        # If nothing to commit, ignore
-        if "nothing to commit" not in (r.stdout + r.stderr).lower():
-            raise RuntimeError(f"git commit failed: {r.stderr}")
+    paths = [str(out_path), str(log_path)] + [str(f) for f in (TASKS_F, STATE_LOG) if f.exists()]
+    env = {"GIT_INDEX_FILE": str(Path(tempfile.gettempdir()) / f"llm-hub-index-{uuid.uuid4().hex}")}
+    try:
+        git_out(["read-tree", parent] if parent else ["read-tree", "--empty"], env=env)
+        git_out(["add", "-f", "--"] + paths, env=env)
+        tree = git_out(["write-tree"], env=env)
+    finally:
+        Path(env["GIT_INDEX_FILE"]).unlink(missing_ok=True)
+    if parent and tree == git_out(["rev-parse", f"{parent}^{{tree}}"]):
+        return name  # nothing to commit
+    sha = git_out(["commit-tree", tree, "-m", f"content: {goal}"] + (["-p", parent] if parent else []))
+    git_out(["update-ref", ref, sha, tip or "0" * 40])  # compare-and-swap against the tip we built on
+    return name
 
 # ---- Queue ----
 def load_state():
@@ -216,9 +472,19 @@ def load_state():
 def save_state(state):
     STATE_F.write_text(json.dumps(state, indent=2, ensure_ascii=False), encoding="utf-8")
 
-def run_queue():
-    state = load_state(); processed = set(state.get("processed", []))
-    if not TASKS_F.exists(): print(f"[QUEUE] No tasks file at {TASKS_F.resolve()}"); return
+def load_processed():
+    processed = {ln.strip() for ln in STATE_LOG.read_text(encoding="utf-8").splitlines() if ln.strip()} if STATE_LOG.exists() else set()
+    processed.update(load_state().get("processed", []))  # pick up runs recorded before state.log existed
+    return processed
+
+def mark_processed(tid: str):
+    """Durably record one finished task; an interrupted queue keeps everything done so far."""
+    with STATE_LOG.open("a", encoding="utf-8") as f:
+        f.write(tid + "\n"); f.flush(); os.fsync(f.fileno())
+
+def load_tasks():
+    """Read tasks.jsonl into unique (tid, goal) pairs, skipping blank/invalid lines."""
+    tasks, seen = [], set()
     with TASKS_F.open("r", encoding="utf-8") as f:
         for line in f:
             line = line.strip()
@@ -227,33 +493,63 @@ def run_queue():
             except Exception: print(f"[QUEUE] Skip invalid JSON: {line[:120]}"); continue
             goal = (task.get("goal") or "").strip()
             if not goal: print("[QUEUE] Skip task without 'goal'"); continue
-            tid = task.get("id") or task_id_for(goal)
-            if tid in processed: print(f"[QUEUE] Skip already processed: {tid}"); continue
-            print(f"[QUEUE] Running: {tid} -> {goal}")
-            branch = checkout_task_branch(goal)
-            out_path, log_path = run_pipeline(goal)
-            commit_artifacts(goal, out_path, log_path)
-            processed.add(tid)
-    state["processed"] = sorted(processed); save_state(state)
-    print("[QUEUE] Done.")
+            tid = str(task.get("id") or task_id_for(goal))  # state.log stores ids as text
+            if tid in seen: continue
+            seen.add(tid); tasks.append((tid, goal))
+    return tasks
+
+async def run_queue_async(max_concurrency=CONCURRENCY, fused=False):
+    """Run pending tasks concurrently; LLM calls overlap, git work is serialized."""
+    processed = load_processed()
+    if not TASKS_F.exists(): print(f"[QUEUE] No tasks file at {TASKS_F.resolve()}"); return
+    pending = []
+    for tid, goal in load_tasks():
+        if tid in processed: print(f"[QUEUE] Skip already processed: {tid}"); continue
+        pending.append((tid, goal))
+    sem = asyncio.Semaphore(max(1, max_concurrency))
+    git_lock = asyncio.Lock()  # one ref update at a time; tasks sharing a goal share a branch
+
+    failed = []
+
+    async def run_task(tid, goal):
+        try:
+            async with sem:
+                say(f"[QUEUE] Running: {tid} -> {goal}")
+                out_path, log_path = await asyncio.to_thread(run_pipeline, goal, tid, fused)
+            async with git_lock:
+                branch = await asyncio.to_thread(commit_artifacts, goal, out_path, log_path)
+            say(f"[GIT] {tid} committed on branch: {branch}")
+            mark_processed(tid); processed.add(tid)
+        except Exception as e:  # one bad task must not abort the others; it is retried next run
+            say(f"[QUEUE] Failed: {tid}: {e}"); failed.append(tid)
+
+    await asyncio.gather(*(run_task(tid, goal) for tid, goal in pending))
+    print(f"[QUEUE] Done. Ran {len(pending)} task(s), failed: {len(failed)}.")
+
+def run_queue(max_concurrency=CONCURRENCY, fused=False):
+    asyncio.run(run_queue_async(max_concurrency, fused))
 
 # ---- CLI ----
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--goal", type=str, help="Run a single goal immediately and commit on a task branch.")
     parser.add_argument("--queue", action="store_true", help="Process tasks.jsonl; create branch+commit per task.")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Max queue tasks in flight at once.")
+    parser.add_argument("--fused", action="store_true", help="Plan and work in a single LLM call.")
+    parser.add_argument("--export-state", action="store_true", help="Also write the processed set to state.json after --queue.")
+    parser.add_argument("--cache", action="store_true", help="Cache responses regardless of temperature.")
     args = parser.parse_args()
+    if args.cache: CACHE_ALWAYS = True
 
     if args.goal:
-        branch = checkout_task_branch(args.goal)
-        out_path, log_path = run_pipeline(args.goal)
-        commit_artifacts(args.goal, out_path, log_path)
+        out_path, log_path = run_pipeline(args.goal, fused=args.fused)
+        branch = commit_artifacts(args.goal, out_path, log_path)
         print(f"[GIT] Committed on branch: {branch}")
     elif args.queue:
-        run_queue()
+        run_queue(args.concurrency, args.fused)
+        if args.export_state: save_state({"processed": sorted(load_processed())})
     else:
         default = "Draft a 3-post intro for Triebold Institute (≤280 chars each) with a CTA to join the mailing list."
-        branch = checkout_task_branch(default)
-        out_path, log_path = run_pipeline(default)
-        commit_artifacts(default, out_path, log_path)
+        out_path, log_path = run_pipeline(default, fused=args.fused)
+        branch = commit_artifacts(default, out_path, log_path)
         print(f"[GIT] Committed on branch: {branch}")